@@ -0,0 +1,339 @@
+'''
+Objective:  Run the grading stages on different execution engines
+
+The merge, gradebook and extrapolate scripts describe their calculations through a
+small backend interface instead of calling pandas directly. Two backends are provided:
+
+    * PandasBackend -- the default. Works on in-memory pandas dataframes and gives
+      the same results as the original scripts.
+    * DuckDBBackend -- a lazy, columnar engine. Frames are DuckDB relations read from
+      .parquet or .csv files and nothing is computed until the result is collected or
+      written. DuckDB spills to disk and uses all cores, so a whole term of sections
+      can be graded on one machine even when the scores do not fit in memory.
+
+DuckDB is optional and only needs to be installed to use DuckDBBackend.
+
+Expressions are built from backend.col() and combined with the usual arithmetic
+operators, backend.round(), backend.cap() and backend.bucket(). A new column is added
+with backend.assign(), which returns the updated frame. Raw exports are cleaned with
+backend.lower(), backend.extract(), backend.rename() and the drop methods, as in the
+scan_roster(), scan_hmwk() and scan_lms() functions of merge_csvs.py.
+'''
+
+import re
+
+import pandas as pd
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+
+class PandasBackend:
+    '''Evaluate the grading stages eagerly with pandas dataframes'''
+
+    def read(self, filename):
+        '''Load a .csv, .parquet or .xlsx file into a dataframe'''
+
+        if filename.endswith(".parquet"):
+            return pd.read_parquet(filename)
+
+        if filename.endswith(".csv"):
+            return pd.read_csv(filename, index_col=0)
+
+        return pd.read_excel(filename, header=0, index_col=0)
+
+    def write(self, frame, filename):
+        '''Save a dataframe as a .csv, .parquet or .xlsx file'''
+
+        if filename.endswith(".parquet"):
+            frame.to_parquet(filename)
+
+        elif filename.endswith(".csv"):
+            frame.to_csv(filename)
+
+        else:
+            frame.to_excel(filename, sheet_name='Sheet1')
+
+    def collect(self, frame):
+        '''Return the frame as a pandas dataframe'''
+
+        return frame
+
+    def merge(self, left, right, left_on, right_on):
+        '''Inner join two dataframes. A key that names the index joins on the index.'''
+
+        keys = {}
+
+        if left_on == left.index.name:
+            keys['left_index'] = True
+        else:
+            keys['left_on'] = left_on
+
+        if right_on == right.index.name:
+            keys['right_index'] = True
+        else:
+            keys['right_on'] = right_on
+
+        return pd.merge(left, right, **keys)
+
+    def fillna(self, frame, value):
+        '''Fill missing values in every column'''
+
+        return frame.fillna(value)
+
+    def drop(self, frame, column):
+        '''Remove a column'''
+
+        return frame.drop(column, axis=1)
+
+    def drop_containing(self, frame, text):
+        '''Remove every column whose header contains some text'''
+
+        return frame.drop([col for col in frame.columns if text in col], axis=1)
+
+    def drop_empty(self, frame):
+        '''Remove every column that only contains missing values'''
+
+        return frame.dropna(axis=1, how="all")
+
+    def rename(self, frame, headers):
+        '''Replace the column headers, in order, and return the frame'''
+
+        frame.columns = list(headers)
+
+        return frame
+
+    def lower(self, frame, column):
+        '''Lower-case a column as text'''
+
+        return self.assign(frame, column, frame[column].astype(str).str.lower())
+
+    def extract(self, frame, column, regex):
+        '''Keep only the part of a text column matching the first group of a regex'''
+
+        return self.assign(frame, column, frame[column].str.extract(regex, expand=False))
+
+    def col(self, frame, name):
+        '''Return a column as an expression'''
+
+        return frame[name]
+
+    def sum_matching(self, frame, regex):
+        '''Return the row sums of all columns whose headers match a regex
+
+        Missing scores count as 0. The columns are added one at a time in header order,
+        so the sums do not depend on how pandas lays out or masks the data, and match
+        the DuckDB backend and the kernels in kernels.py to the last bit.
+        '''
+
+        matching = frame.filter(regex=regex, axis=1)
+        if matching.shape[1] == 0:
+            return matching.sum(axis=1)
+
+        total = 0
+        for num in range(matching.shape[1]):
+            total = total + matching.iloc[:, num].fillna(0)
+
+        return total
+
+    def round(self, expr, decimals):
+        '''Round an expression to a number of decimals'''
+
+        return round(expr, decimals)
+
+    def cap(self, expr, limit, placeholder='-'):
+        '''Replace values above a limit with a placeholder'''
+
+        return expr.apply(lambda x: x if x <= limit else placeholder)
+
+    def bucket(self, expr, scale):
+        '''Map values to labels using a dictionary of lower bounds, highest first'''
+
+        def label(value):
+            for bound, name in scale.items():
+                if value >= bound:
+                    return name
+
+        return expr.map(label)
+
+    def assign(self, frame, name, expr):
+        '''Add or replace a column and return the frame'''
+
+        frame[name] = expr
+
+        return frame
+
+
+class DuckDBBackend:
+    '''Evaluate the grading stages lazily with DuckDB relations
+
+    Keyword arguments:
+    memory_limit   -- string. Memory DuckDB may use before spilling to disk, e.g. '4GB'.
+    threads        -- int. Number of worker threads. Defaults to all cores.
+    temp_directory -- string. Directory for spilled data.
+
+    Placeholders from cap() are NULLs since columns in a relation have a single type.
+    '''
+
+    numeric_types = ('TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'HUGEINT',
+                     'UTINYINT', 'USMALLINT', 'UINTEGER', 'UBIGINT', 'FLOAT', 'DOUBLE')
+
+    def __init__(self, memory_limit=None, threads=None, temp_directory=None):
+        if duckdb is None:
+            raise ImportError("DuckDBBackend requires the duckdb package")
+
+        self.con = duckdb.connect()
+
+        if memory_limit is not None:
+            self.con.execute(f"SET memory_limit = '{memory_limit}'")
+        if threads is not None:
+            self.con.execute(f"SET threads = {int(threads)}")
+        if temp_directory is not None:
+            self.con.execute(f"SET temp_directory = '{temp_directory}'")
+
+    def read(self, filename):
+        '''Lazily scan a .parquet or .csv file. Globs such as 'term/*.parquet' are allowed.'''
+
+        if filename.endswith(".parquet"):
+            return self.con.read_parquet(filename)
+
+        if filename.endswith(".csv"):
+            return self.con.read_csv(filename)
+
+        raise ValueError(f"DuckDBBackend cannot read {filename}")
+
+    def write(self, frame, filename):
+        '''Stream a relation to a .parquet or .csv file'''
+
+        if filename.endswith(".parquet"):
+            frame.write_parquet(filename)
+
+        elif filename.endswith(".csv"):
+            frame.write_csv(filename)
+
+        else:
+            raise ValueError(f"DuckDBBackend cannot write {filename}")
+
+    def collect(self, frame):
+        '''Run the query and return the result as a pandas dataframe'''
+
+        return frame.df()
+
+    def merge(self, left, right, left_on, right_on):
+        '''Inner join two relations, keeping only the left key column'''
+
+        joined = left.set_alias('l').join(
+            right.set_alias('r'), f'l."{left_on}" = r."{right_on}"')
+
+        return joined.project(f'l.*, r.* EXCLUDE ("{right_on}")')
+
+    def fillna(self, frame, value):
+        '''Fill missing values in the numeric columns'''
+
+        cols = []
+        for name, dtype in zip(frame.columns, frame.types):
+            dtype = str(dtype)
+            if (dtype in self.numeric_types) | dtype.startswith('DECIMAL'):
+                cols.append(duckdb.CoalesceOperator(
+                    self.col(frame, name), duckdb.ConstantExpression(value)).alias(name))
+            else:
+                cols.append(self.col(frame, name))
+
+        return frame.select(*cols)
+
+    def drop(self, frame, column):
+        '''Remove a column'''
+
+        return frame.select(duckdb.StarExpression(exclude=[column]))
+
+    def drop_containing(self, frame, text):
+        '''Remove every column whose header contains some text'''
+
+        return frame.select(*[self.col(frame, col) for col in frame.columns
+                              if text not in col])
+
+    def drop_empty(self, frame):
+        '''Remove every column that only contains NULLs'''
+
+        # Counting the values of every column is a single scan of the relation
+        counts = frame.aggregate(", ".join(f'count("{col}")' for col in frame.columns))
+        counts = counts.fetchone()
+
+        return frame.select(*[self.col(frame, col)
+                              for col, count in zip(frame.columns, counts) if count])
+
+    def rename(self, frame, headers):
+        '''Replace the column headers, in order, and return the new relation'''
+
+        return frame.select(*[self.col(frame, col).alias(header)
+                              for col, header in zip(frame.columns, headers)])
+
+    def lower(self, frame, column):
+        '''Lower-case a column as text'''
+
+        return self.assign(frame, column, duckdb.FunctionExpression(
+            'lower', self.col(frame, column).cast(duckdb.sqltype('VARCHAR'))))
+
+    def extract(self, frame, column, regex):
+        '''Keep only the part of a text column matching the first group of a regex'''
+
+        match = duckdb.FunctionExpression('regexp_extract', self.col(frame, column),
+                                          duckdb.ConstantExpression(regex),
+                                          duckdb.ConstantExpression(1))
+
+        # Match pandas, which gives a missing value instead of an empty string
+        return self.assign(frame, column, duckdb.FunctionExpression(
+            'nullif', match, duckdb.ConstantExpression('')))
+
+    def col(self, frame, name):
+        '''Return a column as an expression'''
+
+        return duckdb.ColumnExpression(f'"{name}"')
+
+    def sum_matching(self, frame, regex):
+        '''Return the row sums of all columns whose headers match a regex'''
+
+        total = duckdb.ConstantExpression(0)
+        for name in frame.columns:
+            if re.search(regex, name):
+                total = total + duckdb.CoalesceOperator(
+                    self.col(frame, name), duckdb.ConstantExpression(0))
+
+        return total
+
+    def round(self, expr, decimals):
+        '''Round an expression to a number of decimals'''
+
+        return duckdb.FunctionExpression('round', expr, duckdb.ConstantExpression(decimals))
+
+    def cap(self, expr, limit, placeholder=None):
+        '''Replace values above a limit with NULL'''
+
+        return duckdb.CaseExpression(expr <= limit, expr).otherwise(
+            duckdb.ConstantExpression(None))
+
+    def bucket(self, expr, scale):
+        '''Map values to labels using a dictionary of lower bounds, highest first'''
+
+        bounds = list(scale.items())
+        label = duckdb.CaseExpression(expr >= bounds[0][0],
+                                      duckdb.ConstantExpression(bounds[0][1]))
+        for bound, name in bounds[1:]:
+            label = label.when(expr >= bound, duckdb.ConstantExpression(name))
+
+        return label.otherwise(duckdb.ConstantExpression(None))
+
+    def assign(self, frame, name, expr):
+        '''Add or replace a column and return the new relation'''
+
+        if not isinstance(expr, duckdb.Expression):
+            expr = duckdb.ConstantExpression(expr)
+
+        if name in frame.columns:
+            cols = [expr.alias(col) if col == name else self.col(frame, col)
+                    for col in frame.columns]
+            return frame.select(*cols)
+
+        return frame.select(duckdb.StarExpression(), expr.alias(name))
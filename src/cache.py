@@ -0,0 +1,211 @@
+'''
+Objective:  Reuse grading and forecasting results for unchanged gradebooks
+
+Using pandas, this script keeps the results of points_and_weights() and
+predict_grades() so that asking for the same standings twice does not repeat the
+calculations. Scores only change when a new export is merged, so a result is keyed on
+
+    * a hash of the contents of the gradebook dataframe
+    * the week or checkpoint in the course
+    * the version of the grading policy (point distribution and letter scale)
+
+Results are kept in memory up to a size limit, evicting the least recently used
+results first. Results can also be saved to a directory so they survive between runs
+and across processes. The directory has its own size limit, and the saved results
+used least recently are deleted first. A result is saved under a temporary name and
+then renamed, so processes sharing the directory never read a half-written result.
+Counters record how often results were found or recomputed.
+'''
+
+import hashlib
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+
+import pandas as pd
+
+
+def gradebook_hash(df):
+    '''Return a hex digest of the contents, index, headers and dtypes of a dataframe'''
+
+    # Integer and float columns with the same values hash alike, so the dtypes are
+    # part of the digest
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    digest.update(repr(list(df.columns)).encode())
+    digest.update(repr(list(df.dtypes.astype(str))).encode())
+
+    return digest.hexdigest()
+
+
+class ResultCache:
+    '''Least recently used cache of result dataframes
+
+    Keyword arguments:
+    max_bytes      -- int. Memory the cached dataframes may use before the least
+                      recently used ones are evicted.
+    directory      -- string. Optional directory where results are also saved as pickles.
+    max_disk_bytes -- int. Space the saved pickles may use before the least recently
+                      used ones are deleted.
+    '''
+
+    def __init__(self, max_bytes=256 * 2**20, directory=None, max_disk_bytes=2**30):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.results = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, func, df, checkpoint, policy_version, **kwargs):
+        '''Return the cache key for calling func on df at a checkpoint and policy version'''
+
+        parts = [func.__module__, func.__qualname__, str(checkpoint), str(policy_version),
+                 repr(sorted(kwargs.items())), gradebook_hash(df)]
+
+        return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+    def get(self, key):
+        '''Return a copy of the cached result for a key, or None'''
+
+        if key in self.results:
+            self.results.move_to_end(key)
+            self.hits += 1
+            return self.results[key].copy()
+
+        if self.directory is not None:
+            # Another process may delete the pickle while it is being read. A pickle
+            # that cannot be read is treated as missing and recomputed.
+            filename = os.path.join(self.directory, f'{key}.pkl')
+            try:
+                result = pd.read_pickle(filename)
+            except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+                result = None
+
+            if result is not None:
+                # Mark the pickle as recently used so it is deleted last
+                try:
+                    os.utime(filename)
+                except FileNotFoundError:
+                    pass
+                self.store(key, result)
+                self.disk_hits += 1
+                return result.copy()
+
+        self.misses += 1
+
+        return None
+
+    def put(self, key, result):
+        '''Cache a copy of a result, saving it to the directory if one was given'''
+
+        result = result.copy()
+        self.store(key, result)
+
+        if self.directory is not None:
+            self.save(key, result)
+            self.trim_disk()
+
+    def save(self, key, result):
+        '''Save a result to the directory so other processes never see a partial pickle'''
+
+        # Write to a temporary file in the same directory, then rename it into place
+        # in one step. Temporary files do not end in .pkl, so trim_disk() skips them.
+        handle, temp_name = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(handle)
+
+        try:
+            result.to_pickle(temp_name)
+            os.replace(temp_name, os.path.join(self.directory, f'{key}.pkl'))
+        except BaseException:
+            os.remove(temp_name)
+            raise
+
+    def trim_disk(self):
+        '''Delete the least recently used pickles until the directory is under its limit'''
+
+        # Other processes may share the directory and delete pickles at the same time
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pkl'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_disk_bytes:
+                break
+            total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def store(self, key, result):
+        '''Keep a result in memory and evict the least recently used results'''
+
+        if key in self.results:
+            self.nbytes -= self.sizes.pop(key)
+            del self.results[key]
+
+        size = int(result.memory_usage(index=True, deep=True).sum())
+
+        # A result larger than the whole cache is only kept on disk
+        if size > self.max_bytes:
+            return
+
+        self.results[key] = result
+        self.sizes[key] = size
+        self.nbytes += size
+
+        while self.nbytes > self.max_bytes:
+            old_key, _ = self.results.popitem(last=False)
+            self.nbytes -= self.sizes.pop(old_key)
+
+    def call(self, func, df, checkpoint, policy_version, options=None, **kwargs):
+        '''Return func(df, **options, **kwargs), reusing the cached result when there is one
+
+        Keyword arguments:
+        func           -- function that takes a pandas dataframe, e.g. predict_grades
+        df             -- pandas dataframe. Contains the student scores.
+        checkpoint     -- week or other point in the course the result is for.
+        policy_version -- version of the grading policy used by func.
+        options        -- dictionary. Arguments for func that do not change its result,
+                          such as fast. They are left out of the cache key.
+
+        Any other keyword arguments are passed to func and are part of the cache key.
+        '''
+
+        key = self.key(func, df, checkpoint, policy_version, **kwargs)
+
+        result = self.get(key)
+        if result is None:
+            result = func(df.copy(), **(options or {}), **kwargs)
+            self.put(key, result)
+
+        return result
+
+    def stats(self):
+        '''Return the hit and miss counters and the memory in use'''
+
+        return {'hits': self.hits, 'disk hits': self.disk_hits, 'misses': self.misses,
+                'entries': len(self.results), 'bytes': self.nbytes}
+
+    def clear(self):
+        '''Remove all results from memory. Saved results are kept.'''
+
+        self.results.clear()
+        self.sizes.clear()
+        self.nbytes = 0
@@ -0,0 +1,178 @@
+'''
+Objective:  Keep every score in an append-only binary log
+
+Using numpy, this script records scores as they arrive instead of re-merging whole
+.csv exports. Each score is a fixed-width record of
+
+    student index, assignment index, score, timestamp
+
+appended to the end of a binary file. Appending never rewrites earlier records. The
+log is read through a memory map, so it is not copied into memory, and a wide
+gradebook with one row per student and one column per assignment is rebuilt from it
+with a single vectorized scatter. The wide dataframe can be passed straight to
+points_and_weights() or predict_grades().
+
+Student IDs and assignment headers are stored once each, one per line, in two text
+files next to the log, and the records refer to them by their line numbers. When a
+score is recorded more than once, the most recently appended one is used. Only one
+process should append to a log at a time, but any number may read it. Readers reload
+the names before rebuilding the gradebook, so students and assignments added by
+another process are placed in the right cells.
+'''
+
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+
+# Layout of a single record. 24 bytes per score.
+record = np.dtype([('student', '<u4'), ('assignment', '<u4'),
+                   ('score', '<f8'), ('timestamp', '<i8')])
+
+
+class ScoreLog:
+    '''Append-only log of scores stored in a binary file
+
+    Keyword arguments:
+    filename -- string. Path of the log. The student IDs and assignment headers are
+                kept in filename + '.students' and filename + '.assignments'.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.load_all_names()
+
+        # Create an empty log if there is none yet
+        open(filename, 'ab').close()
+
+    def load_names(self, filename):
+        '''Return the names stored one per line in a text file'''
+
+        if not os.path.exists(filename):
+            return []
+
+        # Ignore a last line that another process has not finished writing
+        with open(filename) as names:
+            return names.read().split('\n')[:-1]
+
+    def load_all_names(self):
+        '''Reload the student IDs and assignment headers, including any added since'''
+
+        self.students = self.load_names(self.filename + '.students')
+        self.assignments = self.load_names(self.filename + '.assignments')
+
+        self.student_idx = {sid: idx for idx, sid in enumerate(self.students)}
+        self.assignment_idx = {name: idx for idx, name in enumerate(self.assignments)}
+
+    def indices(self, names, lookup, stored, suffix):
+        '''Return the index of each name, adding new names to the end of their file'''
+
+        new = []
+        idx = np.empty(len(names), dtype=np.uint32)
+
+        for num, name in enumerate(names):
+            name = str(name)
+            if name not in lookup:
+                lookup[name] = len(stored)
+                stored.append(name)
+                new.append(name)
+            idx[num] = lookup[name]
+
+        if new:
+            with open(self.filename + suffix, 'a') as names_file:
+                names_file.write("".join(f'{name}\n' for name in new))
+
+        return idx
+
+    def append(self, students, assignments, scores, timestamp=None):
+        '''Append scores to the end of the log
+
+        Keyword arguments:
+        students    -- list of student IDs, one per score.
+        assignments -- list of assignment headers, one per score.
+        scores      -- list of floats.
+        timestamp   -- int. Time in seconds the scores were recorded. Defaults to now.
+        '''
+
+        self.load_all_names()
+
+        records = np.empty(len(scores), dtype=record)
+        records['student'] = self.indices(students, self.student_idx, self.students,
+                                          '.students')
+        records['assignment'] = self.indices(assignments, self.assignment_idx,
+                                             self.assignments, '.assignments')
+        records['score'] = scores
+        records['timestamp'] = int(time.time()) if timestamp is None else timestamp
+
+        with open(self.filename, 'ab') as log:
+            log.write(records.tobytes())
+
+    def append_gradebook(self, df, timestamp=None):
+        '''Append every score in a wide gradebook, such as the merged .xlsx file
+
+        Keyword arguments:
+        df        -- pandas dataframe indexed on student ID. Every numeric column is
+                     recorded as an assignment and blank scores are skipped. Text
+                     columns such as Student Name and Course Section are not recorded.
+        timestamp -- int. Time in seconds the scores were recorded. Defaults to now.
+
+        Student IDs are stored as text, so gradebook() returns them as strings even if
+        df is indexed on integers.
+        '''
+
+        scores = df.select_dtypes('number')
+        values = scores.to_numpy(dtype=np.float64)
+        rows, cols = np.nonzero(~np.isnan(values))
+
+        self.append(scores.index.to_numpy()[rows], scores.columns.to_numpy()[cols],
+                    values[rows, cols], timestamp)
+
+    def records(self):
+        '''Return a read-only memory map of the records in the log'''
+
+        # Ignore a last record that another process has not finished writing
+        n_records = os.path.getsize(self.filename) // record.itemsize
+        if n_records == 0:
+            return np.empty(0, dtype=record)
+
+        return np.memmap(self.filename, dtype=record, mode='r', shape=(n_records,))
+
+    def gradebook(self, as_of=None):
+        '''Return the wide gradebook of the latest score of each student and assignment
+
+        Keyword arguments:
+        as_of -- int. Only use scores recorded at or before this time in seconds.
+
+        Returns a pandas dataframe indexed on student ID, as strings, with one column
+        per assignment in the order they were first logged. Scores that were never
+        recorded are NaN. Only scores are logged, so join the roster's Student Name and
+        Course Section columns before passing the result to reports.write_reports().
+        '''
+
+        # Read the names after the records so every record refers to a known name. The
+        # names are always written before the records that use them.
+        records = self.records()
+        self.load_all_names()
+
+        n_students, n_assignments = len(self.students), len(self.assignments)
+
+        keep = (records['student'] < n_students) & (records['assignment'] < n_assignments)
+        if as_of is not None:
+            keep &= records['timestamp'] <= as_of
+        records = records[keep]
+
+        # Keep only the last record of each student and assignment. Reversing the log
+        # makes np.unique find the most recently appended record first.
+        cells = (records['student'].astype(np.int64) * n_assignments
+                 + records['assignment'])
+        cells, last = np.unique(cells[::-1], return_index=True)
+        scores = records['score'][::-1][last]
+
+        matrix = np.full(n_students * n_assignments, np.nan)
+        matrix[cells] = scores
+
+        return pd.DataFrame(matrix.reshape(n_students, n_assignments),
+                            index=pd.Index(self.students, name='Student ID'),
+                            columns=self.assignments)
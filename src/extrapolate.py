@@ -11,6 +11,10 @@ extrapolate for a points-based grading scheme.
 import pandas as pd
 from datetime import datetime
 
+import kernels
+from backends import PandasBackend
+from cache import ResultCache
+
 
 # File path for the merged xlsx file. Included the three scenarios in which
 # students are most interested in their standing in the class.
@@ -36,12 +40,43 @@ max_weeks = 6
 # Sixth week but before taking the finals
 num_weeks = 6
 
+# Version of the point distribution and letter grade scale in predict_grades(). Increase
+# it whenever either changes so that cached forecasts are recalculated.
+policy_version = 1
+
+# Forecasts already calculated, keyed on the scores, num_weeks and policy_version
+forecast_cache = ResultCache()
+
+
+def unattainable(values, limit, index):
+    '''Return a series of values where those above the limit are replaced by '-'
+
+    Keyword arguments:
+    values -- numpy array. Points or percentages needed for a letter grade.
+    limit  -- float. The largest attainable value.
+    index  -- pandas index for the series.
+    '''
+
+    col = pd.Series(values, index=index)
+    over = ~(values <= limit)
 
-def predict_grades(df):
+    if over.any():
+        col = col.astype(object)
+        col[over] = '-'
+
+        # Like Series.apply(), give a column of only placeholders the string dtype
+        col = col.infer_objects()
+
+    return col
+
+
+def predict_grades(df, backend=PandasBackend(), fast=False):
     '''Create new columns of needed points and percentages for grades in a pandas dataframe
 
     Keyword arguments:
-    df -- pandas dataframe
+    df      -- pandas dataframe, or a relation for a lazy backend
+    backend -- backend used to run the calculations. Defaults to pandas.
+    fast    -- bool. Use the one-pass kernels in kernels.py. Pandas dataframes only.
 
     This function takes a pandas dataframe of student scores and calculates the point
     total for each category of assignments in new columns.
@@ -121,47 +156,88 @@ def predict_grades(df):
                     'TTL Cumulative': r'Cumulative',
                     'TTL XCs': r'XC'}
 
+    # Scale for the letter grades A through D in the class.
+    letter_dict = {"A": 0.90, "B": 0.80, "C": 0.70, "D": 0.60}
+
+    # Compute the current points, score and needed points in one pass over the scores
+    # with the compiled kernels. The results are identical to the calculations below.
+    if fast and not isinstance(backend, PandasBackend):
+        raise ValueError("fast=True only works with the pandas backend")
+
+    if fast:
+        passed = [k for k in student_dict if k in now_dict]
+        values, groups = kernels.group_columns(df, [student_dict[k] for k in passed])
+        totals, current, score, needed, percent = kernels.forecast_block(
+            values, groups, len(passed), pts_now,
+            [letter_dict[lett] * max_pts for lett in letter_dict], pts_remaining)
+
+        for num, k in enumerate(passed):
+            df[k] = totals[:, num]
+        df['Current Pts'] = current
+        df['Current Score'] = score
+        df['Completed Pts'] = pts_now
+        df['Remaining Pts'] = pts_remaining
+
+        for num, lett in enumerate(letter_dict):
+            df[f'Pts Needed ({lett})'] = unattainable(needed[:, num], pts_remaining, df.index)
+            df[f'% Needed ({lett})'] = unattainable(percent[:, num], 1.0, df.index)
+
+        return df
+
     # Use regex to sum the student scores for each category of assignments that have
     # passed; those assignments are in now_dict.
     for k, v in student_dict.items():
         if k in now_dict:
-            df[k] = df.filter(regex=v, axis=1).sum(axis=1)
+            df = backend.assign(df, k, backend.sum_matching(df, v))
 
     # Use regex to obtain the current points and score for each student
-    df['Current Pts'] = df.filter(regex=r'TTL', axis=1).sum(axis=1)
-    df['Current Score'] = round(df['Current Pts'] / pts_now, 4)
+    df = backend.assign(df, 'Current Pts', backend.sum_matching(df, r'TTL'))
+    df = backend.assign(df, 'Current Score', backend.round(
+        backend.col(df, 'Current Pts') / pts_now, 4))
 
     # Keep track of the maximum number of points completed and remaining in the class
     # by adding these columns to the dataframe.
-    df['Completed Pts'] = pts_now
-    df['Remaining Pts'] = pts_remaining
-
-    # Scale for the letter grades A through D in the class.
-    letter_dict = {"A": 0.90, "B": 0.80, "C": 0.70, "D": 0.60}
+    df = backend.assign(df, 'Completed Pts', pts_now)
+    df = backend.assign(df, 'Remaining Pts', pts_remaining)
 
     # Calculate the number of points (and its respective percentage) a student will
     # need at this point in the semester to obtain a specific letter grade.
     for lett in letter_dict:
-        df[f'Pts Needed ({lett})'] = (letter_dict[lett]
-                                      * max_pts) - df['Current Pts']
-        df[f'% Needed ({lett})'] = round(
-            df[f'Pts Needed ({lett})'] / df['Remaining Pts'], 4)
+        df = backend.assign(df, f'Pts Needed ({lett})',
+                            (letter_dict[lett] * max_pts) - backend.col(df, 'Current Pts'))
+        df = backend.assign(df, f'% Needed ({lett})', backend.round(
+            backend.col(df, f'Pts Needed ({lett})') / backend.col(df, 'Remaining Pts'), 4))
 
         # If the number of points the students need exceeds the number of points
         # remaining or the percentage needed is greater than 1, add a placeholder '-',
         # to indicate the letter grade is not attainable.
-        df[f'Pts Needed ({lett})'] = df[f'Pts Needed ({lett})'].apply(
-            lambda x: x if x <= pts_remaining else '-')
-        df[f'% Needed ({lett})'] = df[f'% Needed ({lett})'].apply(
-            lambda x: x if x <= 1.0 else '-')
+        df = backend.assign(df, f'Pts Needed ({lett})', backend.cap(
+            backend.col(df, f'Pts Needed ({lett})'), pts_remaining))
+        df = backend.assign(df, f'% Needed ({lett})', backend.cap(
+            backend.col(df, f'% Needed ({lett})'), 1.0))
 
     return df
 
 
+def cached_predict_grades(df, fast=False):
+    '''Return predict_grades(df), reusing an earlier forecast for the same scores
+
+    Keyword arguments:
+    df   -- pandas dataframe
+    fast -- bool. Use the one-pass kernels in kernels.py.
+
+    Unlike predict_grades(), df is not modified.
+    '''
+
+    return forecast_cache.call(predict_grades, df, num_weeks,
+                               policy_version, options={'fast': fast})
+
+
 if __name__ == "__main__":
 
-    # Execute the function to obtain current scores and projected scores
-    current_df = predict_grades(df)
+    # Execute the function to obtain current scores and projected scores, reusing the
+    # forecast calculated for the same scores earlier in this run
+    current_df = cached_predict_grades(df)
     print(current_df)
 
     # Save the completed forecasting gradebook to an .xlsx spreadsheet
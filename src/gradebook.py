@@ -8,6 +8,10 @@ totals and use a point total and weights-based system to assign letter grades.
 
 import pandas as pd
 
+import kernels
+from backends import PandasBackend
+from cache import ResultCache
+
 
 # File path for the merged xlsx file
 merged_xlsx = "../data/merged_scores.xlsx"
@@ -21,12 +25,24 @@ num_chaps = 6
 
 # NB: The number of exams will be different
 
+# Scale for the letter grades in the class, highest first
+letter_grades = {0.88: "A", 0.77: "B", 0.66: "C", 0.55: "D", 0: "F"}
+
+# Version of the point distribution and weights in points_and_weights(). Increase it
+# whenever they change so that cached gradebooks are recalculated.
+policy_version = 1
+
+# Gradebooks already calculated, keyed on the scores, num_chaps and policy_version
+grade_cache = ResultCache()
+
 
-def points_and_weights(df):
+def points_and_weights(df, backend=PandasBackend(), fast=False):
     '''Create new columns of point totals and weighted totals in a pandas dataframe
 
     Keyword arguments:
-    df -- pandas dataframe
+    df      -- pandas dataframe, or a relation for a lazy backend
+    backend -- backend used to run the calculations. Defaults to pandas.
+    fast    -- bool. Use the one-pass kernels in kernels.py. Pandas dataframes only.
 
     This function takes a pandas dataframe of student scores and calculates the point
     total for each category of assignments in new columns.
@@ -75,16 +91,6 @@ def points_and_weights(df):
                 'TTL Cumulative': r'Cumulative',
                 'TTL XCs': r'XC'}
 
-    # Use regex to sum the student scores for each category of assignments.
-    for k, v in new_cols.items():
-        df[k] = df.filter(regex=v, axis=1).sum(axis=1)
-
-    # Use regex to obtain the total points for each student
-    df['TTL Points'] = df.filter(regex=r'TTL', axis=1).sum(axis=1)
-
-    # Calculate the final score according to a points-based system
-    df['Final Score (%)'] = round((df["TTL Points"] / max_pts), 4)
-
     # Create weights for each assignment category including the extra credit. Weights
     # are calculated as the total points per category divided by max_pts. Weights for
     # the exams are divided by 3 so that each exam will have the same weight.
@@ -96,35 +102,84 @@ def points_and_weights(df):
         else:
             weights[category] = round(points / max_pts, 6)
 
+    # Compute every total and score in one pass over the scores with the compiled
+    # kernels. The results are identical to the column-by-column calculations below.
+    if fast and not isinstance(backend, PandasBackend):
+        raise ValueError("fast=True only works with the pandas backend")
+
+    if fast:
+        values, groups = kernels.group_columns(df, list(new_cols.values()))
+        totals, ttl, final, weighted = kernels.grade_block(
+            values, groups, [max_dict[k] for k in new_cols],
+            [weights[k] for k in new_cols], max_pts)
+
+        for num, k in enumerate(new_cols):
+            df[k] = totals[:, num]
+        df['TTL Points'] = ttl
+        df['Final Score (%)'] = final
+        df['Weighted Score (%)'] = weighted
+
+        return df
+
+    # Use regex to sum the student scores for each category of assignments.
+    for k, v in new_cols.items():
+        df = backend.assign(df, k, backend.sum_matching(df, v))
+
+    # Use regex to obtain the total points for each student
+    df = backend.assign(df, 'TTL Points', backend.sum_matching(df, r'TTL'))
+
+    # Calculate the final score according to a points-based system
+    df = backend.assign(df, 'Final Score (%)', backend.round(
+        (backend.col(df, "TTL Points") / max_pts), 4))
+
     # Calculate the final score according to a pseudo weights-based system
-    df['Weighted Score (%)'] = 0
+    weighted = 0
     for category in new_cols:
-        df['Weighted Score (%)'] += round((df[category] /
-                                           max_dict[category]) * weights[category], 4)
+        weighted += backend.round((backend.col(df, category) /
+                                   max_dict[category]) * weights[category], 4)
+    df = backend.assign(df, 'Weighted Score (%)', weighted)
 
     return df
 
 
+def cached_points_and_weights(df, fast=False):
+    '''Return points_and_weights(df), reusing an earlier result for the same scores
+
+    Keyword arguments:
+    df   -- pandas dataframe
+    fast -- bool. Use the one-pass kernels in kernels.py.
+
+    Unlike points_and_weights(), df is not modified.
+    '''
+
+    return grade_cache.call(points_and_weights, df, num_chaps,
+                            policy_version, options={'fast': fast})
+
+
 def mapping_grades(final_percent):
-    '''This function maps letter grades to series data'''
+    '''This function maps letter grades to series data
 
-    letter_dict = {0.88: "A", 0.77: "B", 0.66: "C", 0.55: "D", 0: "F"}
+    Backends apply the same scale to a whole column with backend.bucket().
+    '''
 
-    for percent, letter in letter_dict.items():
+    for percent, letter in letter_grades.items():
         if final_percent >= percent:
             return letter
 
 
 if __name__ == "__main__":
 
-    # Execute the function to obtain point totals and weighted totals
-    final_df = points_and_weights(df)
+    # Execute the function to obtain point totals and weighted totals, reusing the
+    # gradebook calculated for the same scores earlier in this run
+    final_df = cached_points_and_weights(df)
 
     # Generate letter grades for both grading schemes. Use the higher of the two
     # grades for submission.
-    final_df['Points Grade'] = final_df["Final Score (%)"].map(mapping_grades)
-    final_df['Weights Grade'] = final_df["Weighted Score (%)"].map(
-        mapping_grades)
+    backend = PandasBackend()
+    final_df = backend.assign(final_df, 'Points Grade', backend.bucket(
+        backend.col(final_df, "Final Score (%)"), letter_grades))
+    final_df = backend.assign(final_df, 'Weights Grade', backend.bucket(
+        backend.col(final_df, "Weighted Score (%)"), letter_grades))
 
     # print(final_df)
 
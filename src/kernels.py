@@ -0,0 +1,236 @@
+'''
+Objective:  Compute point totals, scores and needed points in one pass
+
+The gradebook and extrapolate scripts build their totals and scores one pandas column
+at a time, creating many temporary series along the way. The functions in this script
+compute everything for a block of students in a single loop over a numpy array of
+scores. When numba is installed, the loops are compiled to machine code. Otherwise
+the same calculations are done with whole-array numpy operations.
+
+Both versions count missing scores as 0, add scores one column at a time in header
+order and round with rint(x * 10**d) / 10**d. PandasBackend.sum_matching() adds and
+rounds the same way, so the results are identical to the pandas calculations in
+points_and_weights() and predict_grades(), including for gradebooks with blank scores
+such as those from eventlog.py. Run this script to check both versions against pandas.
+'''
+
+import re
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def group_columns(df, patterns):
+    '''Return the scores for each category of assignments as a single numpy array
+
+    Keyword arguments:
+    df       -- pandas dataframe. Contains the student scores.
+    patterns -- list of strings. A regex for each category of assignments.
+
+    The columns whose headers match each regex are gathered in category order. Returns
+    the array of scores and an array with the category number of each of its columns.
+    '''
+
+    cols, groups = [], []
+    for num, regex in enumerate(patterns):
+        for col in df.columns:
+            if re.search(regex, str(col)):
+                cols.append(col)
+                groups.append(num)
+
+    values = df[cols].to_numpy(dtype=np.float64)
+
+    return values, np.array(groups, dtype=np.int64)
+
+
+def round_loop(x, decimals):
+    '''Round a number the same way as numpy.round'''
+
+    scale = 10.0 ** decimals
+    return np.rint(x * scale) / scale
+
+
+def grade_block_loop(values, groups, max_cat, weights, max_pts):
+    '''Loop version of grade_block()'''
+
+    n_students, n_cols = values.shape
+    n_cats = max_cat.shape[0]
+
+    totals = np.zeros((n_students, n_cats))
+    ttl = np.zeros(n_students)
+    final = np.zeros(n_students)
+    weighted = np.zeros(n_students)
+
+    for row in range(n_students):
+        for col in range(n_cols):
+            score = values[row, col]
+            if not np.isnan(score):
+                totals[row, groups[col]] += score
+
+        for cat in range(n_cats):
+            ttl[row] += totals[row, cat]
+            weighted[row] += round_loop((totals[row, cat] / max_cat[cat]) * weights[cat], 4)
+
+        final[row] = round_loop(ttl[row] / max_pts, 4)
+
+    return totals, ttl, final, weighted
+
+
+def grade_block_numpy(values, groups, max_cat, weights, max_pts):
+    '''Numpy version of grade_block()'''
+
+    n_students = values.shape[0]
+    n_cats = max_cat.shape[0]
+    values = np.nan_to_num(values, nan=0.0)
+
+    totals = np.zeros((n_students, n_cats))
+    for col, cat in enumerate(groups):
+        totals[:, cat] += values[:, col]
+
+    ttl = np.zeros(n_students)
+    weighted = np.zeros(n_students)
+    for cat in range(n_cats):
+        ttl += totals[:, cat]
+        weighted += np.round((totals[:, cat] / max_cat[cat]) * weights[cat], 4)
+
+    final = np.round(ttl / max_pts, 4)
+
+    return totals, ttl, final, weighted
+
+
+def forecast_block_loop(values, groups, n_cats, pts_now, targets, remaining):
+    '''Loop version of forecast_block()'''
+
+    n_students, n_cols = values.shape
+    n_letters = targets.shape[0]
+
+    totals = np.zeros((n_students, n_cats))
+    current = np.zeros(n_students)
+    score = np.zeros(n_students)
+    needed = np.zeros((n_students, n_letters))
+    percent = np.zeros((n_students, n_letters))
+
+    for row in range(n_students):
+        for col in range(n_cols):
+            pts = values[row, col]
+            if not np.isnan(pts):
+                totals[row, groups[col]] += pts
+
+        for cat in range(n_cats):
+            current[row] += totals[row, cat]
+
+        score[row] = round_loop(current[row] / pts_now, 4)
+
+        for lett in range(n_letters):
+            needed[row, lett] = targets[lett] - current[row]
+            percent[row, lett] = round_loop(needed[row, lett] / remaining, 4)
+
+    return totals, current, score, needed, percent
+
+
+def forecast_block_numpy(values, groups, n_cats, pts_now, targets, remaining):
+    '''Numpy version of forecast_block()'''
+
+    n_students = values.shape[0]
+    values = np.nan_to_num(values, nan=0.0)
+
+    totals = np.zeros((n_students, n_cats))
+    for col, cat in enumerate(groups):
+        totals[:, cat] += values[:, col]
+
+    current = np.zeros(n_students)
+    for cat in range(n_cats):
+        current += totals[:, cat]
+
+    score = np.round(current / pts_now, 4)
+    needed = targets[np.newaxis, :] - current[:, np.newaxis]
+    percent = np.round(needed / remaining, 4)
+
+    return totals, current, score, needed, percent
+
+
+if njit is not None:
+    round_loop = njit(cache=True)(round_loop)
+    grade_block_impl = njit(cache=True)(grade_block_loop)
+    forecast_block_impl = njit(cache=True)(forecast_block_loop)
+else:
+    grade_block_impl = grade_block_numpy
+    forecast_block_impl = forecast_block_numpy
+
+
+def grade_block(values, groups, max_cat, weights, max_pts):
+    '''Compute the point totals and scores for a block of students
+
+    Keyword arguments:
+    values  -- numpy array. Scores from group_columns(), one row per student.
+    groups  -- numpy array. Category number of each column in values.
+    max_cat -- list of floats. Maximum points for each category.
+    weights -- list of floats. Weight of each category.
+    max_pts -- float. Maximum points in the class, excluding extra credit.
+
+    Returns the category totals, total points, final score and weighted score.
+    '''
+
+    return grade_block_impl(values, groups, np.asarray(max_cat, dtype=np.float64),
+                            np.asarray(weights, dtype=np.float64), float(max_pts))
+
+
+def forecast_block(values, groups, n_cats, pts_now, targets, remaining):
+    '''Compute the current score and needed points for a block of students
+
+    Keyword arguments:
+    values    -- numpy array. Scores from group_columns(), one row per student.
+    groups    -- numpy array. Category number of each column in values.
+    n_cats    -- int. Number of categories.
+    pts_now   -- float. Maximum points a student may have accrued so far.
+    targets   -- list of floats. Points needed in the class for each letter grade.
+    remaining -- float. Points remaining in the class.
+
+    Returns the category totals, current points, current score, and the points and
+    percentage needed for each letter grade.
+    '''
+
+    return forecast_block_impl(values, groups, int(n_cats), float(pts_now),
+                               np.asarray(targets, dtype=np.float64), float(remaining))
+
+
+if __name__ == "__main__":
+
+    import pandas as pd
+
+    import extrapolate
+    import gradebook
+
+    # Random scores with 12 assignments in each category and about 10% left blank.
+    # Wide categories with blanks are where a different order of adding shows up.
+    rng = np.random.default_rng(0)
+    headers = [f'{cat} {num}' for cat in ['Qz', 'Lab', 'Disc', 'HMWK', 'XC']
+               for num in range(1, 13)]
+    headers += ['MidT #1 MCQs', 'MidT #1 SAQs', 'MidT #2 MCQs', 'MidT #2 SAQs',
+                'Cumulative']
+    scores = rng.uniform(0, 5, (10000, len(headers)))
+    scores[:, -5:] *= [45, 30, 45, 30, 100] * rng.uniform(0, 1, (10000, 1))
+    scores[rng.random(scores.shape) < 0.1] = np.nan
+    scores_df = pd.DataFrame(scores, columns=headers)
+
+    # gradebook.py and extrapolate.py call the kernels through the imported module,
+    # not through this script
+    import kernels
+
+    versions = {'numpy': (grade_block_numpy, forecast_block_numpy)}
+    if njit is not None:
+        versions['numba'] = (grade_block_impl, forecast_block_impl)
+
+    for version, (grade_impl, forecast_impl) in versions.items():
+        kernels.grade_block_impl, kernels.forecast_block_impl = grade_impl, forecast_impl
+
+        for func in [gradebook.points_and_weights, extrapolate.predict_grades]:
+            expected = func(scores_df.copy())
+            result = func(scores_df.copy(), fast=True)
+            assert result.equals(expected), f'{version} {func.__name__} differs from pandas'
+
+        print(f'{version}: identical to pandas')
@@ -11,8 +11,14 @@ The .csv files are located in ../data and consist of
     * quiz, lab, discussion and exam grades from a learning management system (LMS)
 '''
 
+import re
+from functools import lru_cache
+
 import pandas as pd
 
+from backends import PandasBackend
+from validate import header_max_pts, validate_grades
+
 
 ###  Load the data in three separate dataframes  ###
 
@@ -21,6 +27,64 @@ roster_csv = "../data/generated_roster.csv"
 hmwk_xc_scores = "../data/generated_hmwk_scores.csv"
 lms_scores = "../data/generated_other_scores.csv"
 
+# Rules to create more succinct column headers for each data source. Each rule is a
+# (regex, replacement) pair. The rules for a source are combined into a single regex
+# so each header is rewritten in one pass instead of a chain of str.replace calls.
+header_rules = {
+    'hmwk': [(r' \([0-9]\.[0-9]\)', ""),
+             (r'Chapter', "CH"),
+             (r': Extra Credit', " XC"),
+             (r': Required', " HMWK")],
+
+    'lms': [(r'Canvas Quiz', "Qz"),
+            (r'Chapter', "CH"),
+            (r'Laboratory', "Lab"),
+            (r'Midterm', "MidT"),
+            (r'Short Answer', "SAQs"),
+            (r'Multiple Choice', "MCQs"),
+            (r'Discussion Week ', "Disc #")]
+}
+
+
+def compile_rules(rules):
+    '''Combine a list of (regex, replacement) rules into a single regex
+
+    Keyword arguments:
+    rules -- list of (regex, replacement) tuples.
+
+    Each rule becomes a named group in one alternation so a single re.sub call applies
+    every rule. Returns the compiled regex and a dictionary of group names to their
+    replacement strings.
+    '''
+
+    pattern = re.compile("|".join(f'(?P<rule{i}>{regex})'
+                                  for i, (regex, _) in enumerate(rules)))
+    replacements = {f'rule{i}': repl for i, (_, repl) in enumerate(rules)}
+
+    return pattern, replacements
+
+
+compiled_rules = {source: compile_rules(rules)
+                  for source, rules in header_rules.items()}
+
+
+@lru_cache(maxsize=None)
+def rename_headers(source, header):
+    '''Return the succinct column headers for a raw header row
+
+    Keyword arguments:
+    source -- string. Key in header_rules, either 'hmwk' or 'lms'.
+    header -- tuple of strings. The raw column headers.
+
+    The result is cached on the source and raw header row. Exports from the same
+    provider share a layout, so only the first file of each layout is processed.
+    '''
+
+    pattern, replacements = compiled_rules[source]
+
+    return tuple(pattern.sub(lambda match: replacements[match.lastgroup], col)
+                 for col in header)
+
 
 def load_roster(roster_filename):
     '''Load the roster, a csv file, into a dataframe
@@ -69,7 +133,8 @@ def load_hmwk(hmwk_filename):
     are retained.
 
     The maximum points for each assignment are not designated in a separate row.
-    Instead, they are listed in the title of the assignment.
+    Instead, they are listed in the title of the assignment. They are kept in
+    hmwk_df.attrs['max_pts'] before the titles are shortened.
     '''
 
     # Load the homework and extra credit assignment grades
@@ -91,10 +156,11 @@ def load_hmwk(hmwk_filename):
     hmwk_df.dropna(axis=1, how="all", inplace=True)
 
     # Remove extraneous wording in column headers to create more succinct headers
-    hmwk_df.columns = hmwk_df.columns.str.replace(r'( \([0-9].[0-9]\))', "")
-    hmwk_df.columns = hmwk_df.columns.str.replace("Chapter", "CH")
-    hmwk_df.columns = hmwk_df.columns.str.replace(": Extra Credit", " XC")
-    hmwk_df.columns = hmwk_df.columns.str.replace(": Required", " HMWK")
+    raw_header = tuple(hmwk_df.columns)
+    hmwk_df.columns = rename_headers('hmwk', raw_header)
+
+    # Keep the maximum points from the original headers to validate the scores later on
+    hmwk_df.attrs['max_pts'] = header_max_pts(raw_header, hmwk_df.columns)
 
     return hmwk_df
 
@@ -127,41 +193,116 @@ def load_lms(lms_filename):
     )
 
     # Housecleaning of column titles.
-    lms_df.columns = lms_df.columns.str.replace("Canvas Quiz", "Qz")
-    lms_df.columns = lms_df.columns.str.replace("Chapter", "CH")
-    lms_df.columns = lms_df.columns.str.replace("Laboratory", "Lab")
+    lms_df.columns = rename_headers('lms', tuple(lms_df.columns))
+
+    return lms_df
 
-    lms_df.columns = lms_df.columns.str.replace("Midterm", "MidT")
-    lms_df.columns = lms_df.columns.str.replace("Short Answer", "SAQs")
-    lms_df.columns = lms_df.columns.str.replace("Multiple Choice", "MCQs")
 
-    lms_df.columns = lms_df.columns.str.replace("Discussion Week ", "Disc #")
+def scan_roster(roster_filename, backend):
+    '''Lazily load and clean the roster with a backend such as DuckDBBackend
 
-    return lms_df
+    Keyword arguments:
+    roster_filename -- string. File path for the roster, a .csv or .parquet file.
+    backend         -- backend used to read and clean the roster.
+
+    The roster is cleaned the same way as in load_roster(), but "Student ID" stays a
+    column instead of the index.
+    '''
 
+    roster = backend.read(roster_filename)
 
-def merge_grades(roster, exams_qzzes, hmwk):
+    for col in ["Student ID", "Student Name", "Academic Program", "Preferred Email"]:
+        roster = backend.lower(roster, col)
+
+    return backend.extract(roster, "Student Name", r'([a-z]+, [a-z]+)')
+
+
+def scan_hmwk(hmwk_filename, backend):
+    '''Lazily load and clean the homework scores with a backend such as DuckDBBackend
+
+    Keyword arguments:
+    hmwk_filename -- string. File path for the homework scores, a .csv or .parquet file.
+    backend       -- backend used to read and clean the scores.
+
+    The scores are cleaned the same way as in load_hmwk(), but "Name" stays a column
+    instead of the index. Dropping the empty columns reads the file once.
+    '''
+
+    hmwk = backend.read(hmwk_filename)
+    hmwk = backend.drop_containing(hmwk, "E-BOOK")
+    hmwk = backend.drop_empty(hmwk)
+    hmwk = backend.lower(hmwk, "Name")
+
+    return backend.rename(hmwk, rename_headers('hmwk', tuple(hmwk.columns)))
+
+
+def scan_lms(lms_filename, backend):
+    '''Lazily load and clean the LMS scores with a backend such as DuckDBBackend
+
+    Keyword arguments:
+    lms_filename -- string. File path for the LMS scores, a .csv or .parquet file.
+    backend      -- backend used to read and clean the scores.
+
+    The scores are cleaned the same way as in load_lms(), but "Student ID Number" stays
+    a column instead of the index.
+    '''
+
+    lms = backend.read(lms_filename)
+    lms = backend.lower(lms, "Name")
+    lms = backend.lower(lms, "Student ID Number")
+
+    return backend.rename(lms, rename_headers('lms', tuple(lms.columns)))
+
+
+def check_cleaned(frame, source):
+    '''Raise a ValueError if a frame still has the raw headers of an export
+
+    Keyword arguments:
+    frame  -- dataframe or relation of scores.
+    source -- string. Key in header_rules, either 'hmwk' or 'lms'.
+    '''
+
+    pattern, _ = compiled_rules[source]
+
+    raw = [col for col in frame.columns if pattern.search(str(col))]
+    if raw:
+        raise ValueError(f"{raw[0]!r} is a raw {source} header. Clean the scores with "
+                         f"load_{source}() or scan_{source}() before merging.")
+
+
+def merge_grades(roster, exams_qzzes, hmwk, backend=PandasBackend(),
+                 merged_filename="../data/merged_scores.xlsx"):
     '''This function merges three dataframes: roster, exams scores and homework scores.
 
     The merged dataframe is saved as an .xlsx spreadsheet.
 
     Keyword arguments:
-    roster      -- pandas dataframe. Contains generated roster information
-    exams_qzzes -- pandas dataframe. Contains generated assignment scores
-    hmwk        -- pandas dataframe. Contains generated homework & extra credit scores
+    roster          -- pandas dataframe. Contains generated roster information
+    exams_qzzes     -- pandas dataframe. Contains generated assignment scores
+    hmwk            -- pandas dataframe. Contains generated homework & extra credit scores
+    backend         -- backend used to run the merge. Defaults to pandas.
+    merged_filename -- string. File path and name for the merged scores.
+
+    With a DuckDBBackend, the three inputs are the relations returned by scan_roster(),
+    scan_lms() and scan_hmwk(), and merged_filename must be a .parquet or .csv file.
+    Scores that still have the raw headers of an export raise a ValueError, since they
+    would not match the categories in gradebook.py.
     '''
 
+    check_cleaned(exams_qzzes, 'lms')
+    check_cleaned(hmwk, 'hmwk')
+
     # NB: Student Name and Student both appear as columns and both contain student names.
-    final = pd.merge(roster, exams_qzzes, left_index=True, right_index=True)
-    final = pd.merge(final, hmwk, left_on="Student Name", right_index=True)
+    final = backend.merge(roster, exams_qzzes, "Student ID", "Student ID Number")
+    final = backend.merge(final, hmwk, "Student Name", "Name")
 
     # Fill any missing assignment scores, NaN with 0
-    final = final.fillna(0)
+    final = backend.fillna(final, 0)
 
     # Drop the duplicate Name column
-    final.drop("Name", inplace=True, axis=1)
+    final = backend.drop(final, "Name")
 
-    final.to_excel("../data/merged_scores.xlsx", sheet_name='Sheet1')
+    backend.write(final, merged_filename)
 
     return final
 
@@ -171,6 +312,14 @@ if __name__ == "__main__":
     roster = load_roster(roster_csv)
     hmwk_xc = load_hmwk(hmwk_xc_scores)
     exams_quizzes = load_lms(lms_scores)
+
+    # Check the scores and enrollments before merging. Missing scores are expected and
+    # are filled with 0, so only report the other problems.
+    report, flags = validate_grades(roster, exams_quizzes, hmwk_xc)
+    if report.drop('missing').any():
+        print("---------- VALIDATION ----------")
+        print(report)
+
     merged_df = merge_grades(roster, exams_quizzes, hmwk_xc)
 
     # print("---------- ROSTER ----------")
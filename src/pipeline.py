@@ -0,0 +1,224 @@
+'''
+Objective:  Load, clean and merge student data for many courses at once
+
+merge_csvs.py loads the roster, homework scores and LMS scores of one course and
+merges them. This script does the same for every course directory in courses_dir as
+a two-stage pipeline so that reading the files of one course overlaps with merging
+another:
+
+    * read  -- a thread pool reads the three .csv files of each course into memory.
+               Reading is limited by the disk, not the CPU, so threads are enough.
+    * merge -- a process pool cleans, validates and merges each course and saves its
+               merged_scores.xlsx. This is limited by the CPU, so it runs in processes.
+
+The stages are joined by a bounded queue. When the merge stage falls behind, readers
+wait instead of loading more courses, so memory use stays flat however many courses
+there are. Each stage counts the courses, bytes and time it handles. A course that
+cannot be read or merged is skipped and its error is reported with the results.
+
+Each course directory holds files with the same names as in ../data.
+'''
+
+import io
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import merge_csvs
+from validate import validate_grades
+
+
+# Directory containing one sub-directory per course
+courses_dir = "../data/courses"
+
+# File names in each course directory
+course_files = {'roster': os.path.basename(merge_csvs.roster_csv),
+                'hmwk': os.path.basename(merge_csvs.hmwk_xc_scores),
+                'lms': os.path.basename(merge_csvs.lms_scores)}
+
+merged_name = "merged_scores.xlsx"
+
+
+class StageCounter:
+    '''Thread-safe counters of the courses, bytes and busy time of a pipeline stage'''
+
+    def __init__(self, name):
+        self.name = name
+        self.courses = 0
+        self.nbytes = 0
+        self.busy = 0.0
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def add(self, nbytes, seconds):
+        '''Record one course'''
+
+        with self.lock:
+            self.courses += 1
+            self.nbytes += nbytes
+            self.busy += seconds
+
+    def stats(self):
+        '''Return the counters and the throughput since the stage started'''
+
+        elapsed = time.perf_counter() - self.start
+
+        with self.lock:
+            return {'stage': self.name, 'courses': self.courses, 'bytes': self.nbytes,
+                    'busy (s)': round(self.busy, 3),
+                    'courses/s': round(self.courses / elapsed, 2) if elapsed else 0.0}
+
+
+def read_course(course):
+    '''Read the roster, homework and LMS files of a course directory as text'''
+
+    texts = {}
+    for source, filename in course_files.items():
+        with open(os.path.join(course, filename)) as csvfile:
+            texts[source] = csvfile.read()
+
+    return texts
+
+
+def merge_course(course, texts):
+    '''Clean, validate and merge the files of one course
+
+    Keyword arguments:
+    course -- string. Path of the course directory.
+    texts  -- dictionary. Contents of the roster, homework and LMS files.
+
+    Runs in a worker process. The merged dataframe is saved in the course directory
+    rather than sent back, so only the validation report and counters are returned.
+    '''
+
+    start = time.perf_counter()
+
+    roster = merge_csvs.load_roster(io.StringIO(texts['roster']))
+    hmwk_xc = merge_csvs.load_hmwk(io.StringIO(texts['hmwk']))
+    exams_quizzes = merge_csvs.load_lms(io.StringIO(texts['lms']))
+
+    report, _ = validate_grades(roster, exams_quizzes, hmwk_xc)
+
+    merge_csvs.merge_grades(roster, exams_quizzes, hmwk_xc,
+                            merged_filename=os.path.join(course, merged_name))
+
+    nbytes = sum(len(text) for text in texts.values())
+
+    return course, report, nbytes, time.perf_counter() - start
+
+
+def run_pipeline(courses, read_workers=8, merge_workers=None, max_pending=None):
+    '''Merge the files of every course, overlapping reading and merging
+
+    Keyword arguments:
+    courses       -- list of strings. Paths of the course directories.
+    read_workers  -- int. Number of threads reading files.
+    merge_workers -- int. Number of processes merging courses. Defaults to all cores.
+    max_pending   -- int. Most courses read but not yet merged. Defaults to twice the
+                     number of merge processes.
+
+    Returns a dictionary of validation reports keyed on course directory, the counters
+    for each stage and a dictionary of errors keyed on course directory. A course that
+    cannot be read or merged is skipped and only appears in the errors.
+    '''
+
+    merge_workers = merge_workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * merge_workers
+
+    todo = queue.Queue()
+    for course in courses:
+        todo.put(course)
+
+    # Courses that have been read and are waiting to be merged. Readers block when it
+    # is full, which keeps at most max_pending courses in memory.
+    ready = queue.Queue(maxsize=max_pending)
+    done_reading = object()
+
+    read_counter = StageCounter('read')
+    merge_counter = StageCounter('merge')
+
+    def reader():
+        # Always tell the merge stage this reader is done, even if it fails, so the
+        # pipeline can never wait forever
+        try:
+            while True:
+                try:
+                    course = todo.get_nowait()
+                except queue.Empty:
+                    return
+
+                # A course that cannot be read is skipped and its error is reported
+                start = time.perf_counter()
+                try:
+                    texts = read_course(course)
+                except Exception as error:
+                    ready.put((course, error))
+                    continue
+
+                read_counter.add(sum(len(text) for text in texts.values()),
+                                 time.perf_counter() - start)
+                ready.put((course, texts))
+        finally:
+            ready.put(done_reading)
+
+    readers = [threading.Thread(target=reader, daemon=True) for _ in range(read_workers)]
+    for thread in readers:
+        thread.start()
+
+    # Limit the courses handed to the process pool so the executor's own queue does
+    # not grow without bound
+    in_flight = threading.BoundedSemaphore(max_pending)
+    reports = {}
+    errors = {}
+
+    def finished(course, future):
+        in_flight.release()
+        try:
+            _, report, nbytes, seconds = future.result()
+        except Exception as error:
+            errors[course] = error
+            return
+
+        reports[course] = report
+        merge_counter.add(nbytes, seconds)
+
+    with ProcessPoolExecutor(max_workers=merge_workers) as executor:
+        remaining_readers = read_workers
+        while remaining_readers:
+            item = ready.get()
+            if item is done_reading:
+                remaining_readers -= 1
+                continue
+
+            course, texts = item
+            if isinstance(texts, Exception):
+                errors[course] = texts
+                continue
+
+            in_flight.acquire()
+            future = executor.submit(merge_course, course, texts)
+            future.add_done_callback(
+                lambda future, course=course: finished(course, future))
+
+    return reports, [read_counter.stats(), merge_counter.stats()], errors
+
+
+if __name__ == "__main__":
+
+    courses = sorted(entry.path for entry in os.scandir(courses_dir) if entry.is_dir())
+    reports, stats, errors = run_pipeline(courses)
+
+    for stage in stats:
+        print(stage)
+
+    for course, error in errors.items():
+        print(f"---------- {course} skipped ----------")
+        print(repr(error))
+
+    # Only list the courses with problems other than blank scores
+    for course, report in reports.items():
+        if report.drop('missing').any():
+            print(f"---------- {course} ----------")
+            print(report)
@@ -0,0 +1,209 @@
+'''
+Objective:  Create a progress report for every student
+
+Using pandas, this script turns the forecasting gradebook from extrapolate.py into
+one HTML progress report per student showing their current points, current score,
+letter grade and the points needed for each letter grade. The reports of each course
+section are saved together in a single .zip file in reports_dir.
+
+The report template is read and compiled once per process and cached. Students are
+split into chunks that are rendered in parallel by a process pool, and each section's
+reports are written to its .zip file in one go.
+'''
+
+import hashlib
+import html
+import math
+import os
+import re
+import string
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+
+# File path for the report template and the directory for the finished reports
+report_template = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "templates", "progress_report.html")
+reports_dir = "../data/reports"
+
+# Scale for the letter grades A through D in the class, matching extrapolate.py
+letter_scale = {0.90: "A", 0.80: "B", 0.70: "C", 0.60: "D", 0: "F"}
+
+# A row in the table of points needed for each letter grade
+needed_row = string.Template(
+    "<tr><td>$letter</td><td>$pts</td><td>$percent</td></tr>")
+
+
+@lru_cache(maxsize=None)
+def load_template(template_filename):
+    '''Read a report template and compile it into a string.Template'''
+
+    with open(template_filename) as template:
+        return string.Template(template.read())
+
+
+def letter_grade(score):
+    '''Map a score to its letter grade'''
+
+    for percent, letter in letter_scale.items():
+        if score >= percent:
+            return letter
+
+
+def needed_cells(pts, percent):
+    '''Return the text for the points and percentage needed for one letter grade'''
+
+    # extrapolate.py uses '-' when a letter grade can no longer be obtained. Lazy
+    # backends use a blank instead.
+    if (pts == '-') or (pts is None) or math.isnan(pts):
+        return "Not attainable", "-"
+
+    if pts <= 0:
+        return "Already earned", "-"
+
+    return f'{pts:.2f}', f'{percent:.1%}'
+
+
+def render_report(template, sid, row):
+    '''Fill in the report template for one student
+
+    Keyword arguments:
+    template -- string.Template. The compiled report template.
+    sid      -- student ID.
+    row      -- dictionary. The student's row of the forecasting gradebook.
+    '''
+
+    rows = []
+    for letter in letter_scale.values():
+        if f'Pts Needed ({letter})' in row:
+            pts, percent = needed_cells(row[f'Pts Needed ({letter})'],
+                                        row[f'% Needed ({letter})'])
+            rows.append(needed_row.substitute(letter=letter, pts=pts, percent=percent))
+
+    return template.substitute(
+        name=html.escape(str(row['Student Name']).title()),
+        sid=html.escape(str(sid)),
+        section=html.escape("" if is_blank(row['Course Section'])
+                            else str(row['Course Section'])),
+        current_pts=f"{row['Current Pts']:.2f}",
+        completed_pts=f"{row['Completed Pts']:g}",
+        current_score=f"{row['Current Score']:.2%}",
+        letter=letter_grade(row['Current Score']),
+        remaining_pts=f"{row['Remaining Pts']:g}",
+        needed_rows="\n".join(rows))
+
+
+def render_chunk(template_filename, students):
+    '''Render the reports for a chunk of students in a worker process
+
+    Keyword arguments:
+    template_filename -- string. File path for the report template.
+    students          -- list of (student ID, row dictionary) tuples.
+
+    Returns a list of (file name, html) tuples.
+    '''
+
+    template = load_template(template_filename)
+
+    return [(f'{sid}.html', render_report(template, sid, row)) for sid, row in students]
+
+
+def is_blank(value):
+    '''Return True for a missing value such as None or NaN'''
+
+    return (value is None) or (isinstance(value, float) and math.isnan(value))
+
+
+def section_filename(section, taken=()):
+    '''Return a safe .zip file name for a course section
+
+    Keyword arguments:
+    section -- course section. Blank sections are named no_section.zip.
+    taken   -- set of file names already given to other sections.
+
+    Different sections may clean up to the same name, such as 'S-1' and 'S 1'. A name
+    that is already taken gets a short hash of the section appended to it.
+    '''
+
+    # Students without a course section are saved together
+    if is_blank(section):
+        section = "no_section"
+
+    name = re.sub(r'[^A-Za-z0-9]+', '_', str(section)).strip('_')
+
+    if name + '.zip' in taken:
+        name += '_' + hashlib.sha1(str(section).encode()).hexdigest()[:8]
+
+    return name + '.zip'
+
+
+def write_reports(df, template_filename=report_template, out_dir=reports_dir,
+                  workers=None, chunk_size=500):
+    '''Render a progress report for every student and save them by course section
+
+    Keyword arguments:
+    df                -- pandas dataframe. The output of predict_grades() or
+                         cached_predict_grades(), indexed on student ID.
+    template_filename -- string. File path for the report template.
+    out_dir           -- string. Directory for the .zip files.
+    workers           -- int. Number of processes rendering reports. Defaults to all cores.
+    chunk_size        -- int. Number of students sent to a process at a time.
+
+    Students with a blank course section are saved in no_section.zip. Every section
+    gets its own .zip file, even when two sections have the same safe name. Returns a
+    list of the .zip files written.
+    '''
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Only send the columns used in the reports to the worker processes
+    cols = ['Student Name', 'Course Section', 'Current Pts', 'Current Score',
+            'Completed Pts', 'Remaining Pts']
+    cols += [col for col in df.columns if 'Needed (' in col]
+
+    # Split every section into chunks so that small sections are rendered side by side.
+    # Each section is named once, so no two sections share a .zip file.
+    filenames, chunks = [], []
+    taken = set()
+    for section, students in df[cols].groupby('Course Section', sort=False, dropna=False):
+        filename = section_filename(section, taken)
+        taken.add(filename)
+
+        rows = list(zip(students.index, students.to_dict('records')))
+        for i in range(0, len(rows), chunk_size):
+            filenames.append(os.path.join(out_dir, filename))
+            chunks.append(rows[i:i + chunk_size])
+
+    written = []
+    archive = None
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(render_chunk, [template_filename] * len(chunks), chunks)
+
+        # The chunks of a section are consecutive, so start a new .zip file whenever the
+        # section changes. Reopening a .zip file would overwrite the reports in it.
+        for filename, reports in zip(filenames, results):
+            if not written or written[-1] != filename:
+                if filename in written:
+                    raise RuntimeError(f"{filename} was already written")
+                if archive is not None:
+                    archive.close()
+                archive = zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED)
+                written.append(filename)
+
+            for name, text in reports:
+                archive.writestr(name, text)
+
+    if archive is not None:
+        archive.close()
+
+    return written
+
+
+if __name__ == "__main__":
+
+    from extrapolate import cached_predict_grades, df
+
+    # Create the reports from the current forecasting gradebook
+    current_df = cached_predict_grades(df)
+    print(write_reports(current_df))
@@ -0,0 +1,182 @@
+'''
+Objective:  Validate student scores before they are merged and graded
+
+Using numpy and pandas, this script checks the roster, homework and LMS dataframes
+produced by merge_csvs.py. Every score is compared against its assignment's maximum
+points in a single vectorized pass and students are checked for duplicate IDs and
+missing enrollments. Problems are recorded as bit flags so one integer per cell or
+per student describes everything wrong with it:
+
+    * MISSING      -- the score is blank and will be filled with 0 when merged
+    * NEGATIVE     -- the score is less than 0
+    * OVER_MAX     -- the score is greater than the assignment's maximum points
+    * DUPLICATE    -- the student ID or name appears more than once in a source
+    * NOT_ENROLLED -- the student has LMS scores but is not on the roster
+    * NO_LMS       -- the student is on the roster but has no LMS scores
+    * NO_HMWK      -- the student is on the roster but has no homework scores
+'''
+
+import re
+
+import numpy as np
+import pandas as pd
+
+
+# Bit flags for the problems found in a score or a student
+MISSING = 1
+NEGATIVE = 2
+OVER_MAX = 4
+DUPLICATE = 8
+NOT_ENROLLED = 16
+NO_LMS = 32
+NO_HMWK = 64
+
+problems = {'missing': MISSING, 'negative': NEGATIVE, 'over max': OVER_MAX,
+            'duplicate': DUPLICATE, 'not enrolled': NOT_ENROLLED, 'no lms': NO_LMS,
+            'no hmwk': NO_HMWK}
+
+# Maximum points for each type of assignment. The LMS export does not list the maximum
+# points, so these are used for any column whose header did not include them. Keys are
+# regexes matched against the succinct column headers.
+policy_max_pts = {r'Qz': 5.0, r'Lab': 5.0, r'Disc': 2.0, r'HMWK': 5.0, r'XC': 2.0,
+                  r'MCQs': 90.0, r'SAQs': 60.0, r'Cumulative': 100.0}
+
+
+def header_max_pts(raw_header, header):
+    '''Return a dictionary of maximum points listed in the raw column headers
+
+    Keyword arguments:
+    raw_header -- list of strings. Column headers as exported, e.g. 'Chapter 1: Required (5.0)'
+    header     -- list of strings. The succinct column headers, in the same order.
+
+    The homework export lists an assignment's maximum points at the end of its header.
+    The maximum points are keyed on the succinct header of the same column.
+    '''
+
+    max_pts = {}
+    for raw, col in zip(raw_header, header):
+        found = re.search(r'\(([0-9]+\.[0-9]+)\)$', raw)
+        if found:
+            max_pts[col] = float(found.group(1))
+
+    return max_pts
+
+
+def column_max_pts(columns, max_pts=None, policy=policy_max_pts):
+    '''Return a numpy array of the maximum points for each column
+
+    Keyword arguments:
+    columns -- list of strings. Column headers of the scores.
+    max_pts -- dictionary. Maximum points by header, e.g. from header_max_pts().
+    policy  -- dictionary. Maximum points by header regex for all other columns.
+
+    Columns without a known maximum are given an infinite maximum.
+    '''
+
+    max_pts = max_pts or {}
+
+    limits = []
+    for col in columns:
+        if col in max_pts:
+            limits.append(max_pts[col])
+        else:
+            limits.append(next((pts for regex, pts in policy.items()
+                                if re.search(regex, col)), np.inf))
+
+    return np.array(limits, dtype=float)
+
+
+def check_scores(scores, max_pts=None, policy=policy_max_pts):
+    '''Flag blank, negative and over-maximum scores in a dataframe
+
+    Keyword arguments:
+    scores  -- pandas dataframe. Contains the homework or LMS scores.
+    max_pts -- dictionary. Maximum points by header, e.g. from header_max_pts().
+    policy  -- dictionary. Maximum points by header regex for all other columns.
+
+    Only the numeric columns are checked. Returns a dataframe of flags with the same
+    index and numeric columns as scores.
+    '''
+
+    scores = scores.select_dtypes('number')
+    values = scores.to_numpy(dtype=float)
+    limits = column_max_pts(scores.columns, max_pts, policy)
+
+    # Compare every score against its column's maximum at once. NaNs fail every
+    # comparison and are only flagged as missing.
+    flags = np.where(np.isnan(values), MISSING, 0)
+    flags |= np.where(values < 0, NEGATIVE, 0)
+    flags |= np.where(values > limits, OVER_MAX, 0)
+
+    return pd.DataFrame(flags.astype(np.uint8), index=scores.index, columns=scores.columns)
+
+
+def check_students(roster, exams_qzzes, hmwk):
+    '''Flag duplicate students and missing enrollments
+
+    Keyword arguments:
+    roster      -- pandas dataframe. Contains the roster, indexed on student ID.
+    exams_qzzes -- pandas dataframe. Contains the LMS scores, indexed on student ID.
+    hmwk        -- pandas dataframe. Contains the homework scores, indexed on student name.
+
+    Returns a series of flags indexed on every student ID found in the roster or LMS.
+    Homework names that do not match anyone on the roster cannot be given an ID and
+    are returned separately as an index of names.
+    '''
+
+    ids = pd.Index(pd.unique(np.concatenate([roster.index, exams_qzzes.index])),
+                   name=roster.index.name)
+    names = roster['Student Name']
+
+    # Repeated IDs or names would multiply rows when the dataframes are merged
+    dup_ids = roster.index[roster.index.duplicated()].append(
+        exams_qzzes.index[exams_qzzes.index.duplicated()])
+    dup_names = names[names.duplicated()].tolist() + \
+        hmwk.index[hmwk.index.duplicated()].tolist()
+    dup_ids = dup_ids.append(roster.index[names.isin(dup_names)])
+
+    flags = np.where(ids.isin(dup_ids), DUPLICATE, 0)
+    flags |= np.where(~ids.isin(roster.index), NOT_ENROLLED, 0)
+    flags |= np.where(ids.isin(roster.index) & ~ids.isin(exams_qzzes.index), NO_LMS, 0)
+    flags |= np.where(ids.isin(roster.index[~names.isin(hmwk.index)]), NO_HMWK, 0)
+
+    unmatched = hmwk.index[~hmwk.index.isin(names)]
+
+    return pd.Series(flags.astype(np.uint8), index=ids), unmatched
+
+
+def summarize(*flags):
+    '''Count the cells or students with each problem in one or more flag dataframes'''
+
+    counts = dict.fromkeys(problems, 0)
+    for frame in flags:
+        values = np.asarray(frame)
+        for name, bit in problems.items():
+            counts[name] += int(np.count_nonzero(values & bit))
+
+    return pd.Series(counts, name='count')
+
+
+def validate_grades(roster, exams_qzzes, hmwk, policy=policy_max_pts):
+    '''Validate the roster, LMS and homework dataframes before merging
+
+    Keyword arguments:
+    roster      -- pandas dataframe. Contains generated roster information
+    exams_qzzes -- pandas dataframe. Contains generated assignment scores
+    hmwk        -- pandas dataframe. Contains generated homework & extra credit scores
+    policy      -- dictionary. Maximum points by header regex.
+
+    The homework maximum points are taken from hmwk.attrs['max_pts'] when load_hmwk()
+    found them in the headers. Returns a series counting each problem, and a dictionary
+    of the flags for the 'lms' scores, 'hmwk' scores, 'students' and the 'unmatched'
+    homework names.
+    '''
+
+    flags = {'lms': check_scores(exams_qzzes, policy=policy),
+             'hmwk': check_scores(hmwk, hmwk.attrs.get('max_pts'), policy)}
+    flags['students'], flags['unmatched'] = check_students(roster, exams_qzzes, hmwk)
+
+    report = summarize(flags['lms'], flags['hmwk'], flags['students'])
+    report['unmatched hmwk'] = len(flags['unmatched'])
+
+    return report, flags